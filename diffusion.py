@@ -2,6 +2,8 @@ import numpy as np
 import sys, os
 import argparse
 from gen import Model, models
+from framebus import FrameBus
+from stats import Welford, MinMax, Histogram
 from tqdm import *
 from glob import glob
 
@@ -34,7 +36,21 @@ def parseArgs():
 					help="Number of simulations to run")
 	parser.add_argument('--stop-early', action="store_true", default=False,
 					help="Stop once all puffs are closed")
+	parser.add_argument("-tol", type=float, default=None,
+					help="Stop once nothing can open and the field changes by less than tol per step")
+	parser.add_argument("--hazard", type=float, default=None,
+					help="Treat closed sites as unable to open once their opening probability per step is below this")
+	parser.add_argument('--greens', action="store_true", default=False,
+					help="Evolve only the puff sites from precomputed responses instead of the full grid")
+	parser.add_argument('--fixed-sites', action="store_true", default=False,
+					help="Keep the first site layout for every trial instead of drawing a new one")
+	parser.add_argument('--bus', type=int, default=None,
+					help="Publish every r-th frame to a shared memory ring of this many slots")
+	parser.add_argument('--no-traces', action="store_true", default=False,
+					help="Keep running summary statistics per puff instead of every concentration sample")
 	parser.add_argument("--hidden", type=int, default=0, help="Hidden sites to generate")
+	parser.add_argument("-seed", type=int, default=None,
+					help="Random seed. Equal seeds give identical runs")
 
 	args = dict(parser.parse_args()._get_kwargs())
 	
@@ -45,12 +61,17 @@ def parseArgs():
 	args['puffs'] = args.pop('p')
 	args['refresh'] = args.pop('r')
 	args['hidden_puffs'] = args.pop('hidden')
+	args['tolerance'] = args.pop('tol')
+	args['hazard_threshold'] = args.pop('hazard')
+	args['traces'] = not args.pop('no_traces')
 
 	return {k:v for k, v in args.items() if v is not None}
 
 if __name__ == '__main__':
 	args = parseArgs()
 	n = args.pop('n')
+	slots = args.pop('bus', None)
+	fixed = args.pop('fixed_sites')
 	
 	##### SETTINGS ###
 	n = 30
@@ -69,34 +90,70 @@ if __name__ == '__main__':
 	for f in glob('out/*'):
 		os.remove(f)
 	
+	if not args['traces']:
+		mean, extremes, atOpening = Welford(), MinMax(), Histogram(opening=True)
+		args['statistics'] = [mean, extremes, atOpening]
+		openingCounts = 0
+
 	m = Model(**args)
-	for i in tqdm(range(n)):
-		m.genPuffs(len(m.puffs))
-		#np.random.choice(m.puffs).open = True
-		#frames = (m.nt) // m.refresh + 1	
-		frames = 1
-		movie = np.zeros([frames, m.nx+2, m.ny+2])
+	print("Seed: %d" % m.seed)
+	if m.greens and m.sequestration >= 1:
+		print("ALERT: site responses never settle without sequestration, running the full grid instead of greens mode")
+	elif m.greens and not fixed:
+		print("ALERT: greens mode rebuilds its site responses for every new layout, use --fixed-sites for sweeps")
+	bus = None
+	if slots is not None:
+		bus = FrameBus([m.nx+2, m.ny+2], slots)
+		print("Publishing frames to %(name)s, shape %(shape)s, %(slots)d slots" % bus.spec())
+	try:
+		for i in tqdm(range(n)):
+			m.newTrial(i)
+			if not fixed:
+				m.genPuffs(len(m.puffs))
+			#np.random.choice(m.puffs).open = True
+			#frames = (m.nt) // m.refresh + 1	
+			frames = 1
+			movie = np.zeros([frames, m.nx+2, m.ny+2])
 
-		movie[0, 1:-1, 1:-1] = np.random.random([m.nx, m.ny]) * .05
-		j = 1
-		p = 0
-		for im in m.run(movie[0]):
-			if j % m.refresh == 0:
-				movie[0] = im
-				#movie[i // m.refresh] = im
+			movie[0, 1:-1, 1:-1] = m.rng.random([m.nx, m.ny]) * .05
+			j = 1
+			p = 0
+			# greens mode only skips the full grid when no frames are published and sequestration is below 1
+			full = bus is not None or not m.greens or m.sequestration >= 1
+			for im in m.run(movie[0], movie=full):
+				if full and j % m.refresh == 0:
+					if bus is not None:
+						bus.publish(im)
+					else:
+						movie[0] = im
+					#movie[i // m.refresh] = im
 			
-			if (100 * j) // m.nt > p:
-				p = (100 * j) // m.nt
-			j += 1
+				if (100 * j) // m.nt > p:
+					p = (100 * j) // m.nt
+				j += 1
+
+			m.export(open(str(fname), 'wb' if i == 0 else 'ab'))
+			if m.traces:
+				a = []
+				for p in m.puffs:
+					a.append(p.concentrations)
 
-		m.export(open(str(fname), 'wb' if i == 0 else 'ab'))
-		a = []
-		for p in m.puffs:
-			a.append(p.concentrations)
+				arr = np.array(a)
 
-		arr = np.array(a)
+				np.savetxt(open('out/puffs_%d.txt' % i, 'wb'), arr)
+			else:
+				# peak mean variance
+				arr = np.transpose([extremes.max, mean.mean, mean.variance])
+				np.savetxt(open('out/stats_%d.txt' % i, 'wb'), arr)
+				openingCounts = openingCounts + atOpening.counts
 
-		np.savetxt(open('out/puffs_%d.txt' % i, 'wb'), arr)
+		if not m.traces:
+			# bin_start bin_end count, concentration at opening over all trials
+			edges = atOpening.edges
+			np.savetxt('out/opening_histogram.txt', np.transpose([edges[:-1], edges[1:], openingCounts]))
+	finally:
+		if bus is not None:
+			bus.close()
 	'''
 	import pyqtgraph as pg
 	app = pg.Qt.QtGui.QApplication([])
@@ -0,0 +1,143 @@
+import numpy as np
+import sys
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+# names of the blocks created by this process
+_owned = set()
+
+class FrameBus():
+    '''
+    A fixed ring of frame slots in shared memory. The header holds the
+    sequence number of the newest frame followed by the sequence number of
+    the frame in each slot, which reads -1 while the slot is empty or being
+    written.
+    The publisher never waits on readers, so a slow reader drops frames
+    rather than stalling the solver.
+    '''
+
+    def __init__(self, shape, slots=8, dtype=np.float64, name=None, create=True):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.dtype = np.dtype(dtype)
+        self.owner = create
+        header = 8 * (slots + 1)
+        size = header + slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        if create or sys.version_info < (3, 13):
+            self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name, size=size, track=False)
+        if create:
+            _owned.add(self.shm.name)
+        elif sys.version_info < (3, 13) and self.shm.name not in _owned:
+            # the creating process owns the block; keep this process's
+            # resource tracker from unlinking it on exit
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.name = self.shm.name
+        self.sequence = np.ndarray([slots + 1], dtype=np.int64, buffer=self.shm.buf)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=header)
+        if create:
+            self.sequence[0] = 0
+            self.sequence[1:] = -1
+
+    @classmethod
+    def attach(cls, name, shape, slots=8, dtype=np.float64):
+        return cls(shape, slots, dtype, name=name, create=False)
+
+    def spec(self):
+        ''' arguments for FrameBus.attach in another process '''
+        return {'name': self.name, 'shape': self.shape, 'slots': self.slots, 'dtype': self.dtype.str}
+
+    def head(self):
+        return int(self.sequence[0])
+
+    def publish(self, frame):
+        seq = self.head() + 1
+        slot = seq % self.slots
+        self.sequence[1 + slot] = -1
+        self.frames[slot] = frame
+        self.sequence[1 + slot] = seq
+        self.sequence[0] = seq
+        return seq
+
+    def read(self, seq):
+        '''
+        Return a view of frame seq without copying, or None if it has been
+        overwritten. The publisher may reuse the slot at any time, so check
+        valid(seq) after using the view, and keep the bus open while the
+        view is in use.
+        '''
+        slot = seq % self.slots
+        if self.sequence[1 + slot] != seq:
+            return None
+        return self.frames[slot]
+
+    def valid(self, seq):
+        return self.sequence[1 + seq % self.slots] == seq
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.sequence = self.frames = None
+        self.shm.close()
+        if self.owner:
+            _owned.discard(self.name)
+            self.shm.unlink()
+        self.shm = None
+
+class Subscriber():
+    '''
+    Reads frames from a FrameBus in order, skipping any that were
+    overwritten before it got to them. dropped counts the skipped frames.
+    '''
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.last = bus.head()
+        self.dropped = 0
+
+    def poll(self):
+        ''' return (seq, frame) for the next frame still available, or None '''
+        while True:
+            head = self.bus.head()
+            if head <= self.last:
+                return None
+            seq = max(self.last + 1, head - self.bus.slots + 1)
+            frame = self.bus.read(seq)
+            self.dropped += seq - self.last - 1
+            self.last = seq
+            if frame is not None:
+                return seq, frame
+            self.dropped += 1
+
+    def latest(self):
+        ''' return (seq, frame) for the newest frame if it is unread, skipping older ones, or None '''
+        head = self.bus.head()
+        if head <= self.last:
+            return None
+        frame = self.bus.read(head)
+        self.dropped += head - self.last - 1
+        self.last = head
+        if frame is None:
+            self.dropped += 1
+            return None
+        return head, frame
+
+    def frames(self, interval=.01):
+        ''' yield (seq, frame) forever, sleeping while no new frame is available '''
+        while True:
+            item = self.poll()
+            if item is None:
+                time.sleep(interval)
+            else:
+                yield item
+
+if __name__ == '__main__':
+    # watch a bus published by diffusion.py: framebus.py name rows cols slots
+    name, rows, cols, slots = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+    bus = FrameBus.attach(name, [rows, cols], slots)
+    sub = Subscriber(bus)
+    for seq, frame in sub.frames():
+        peak = frame.max()
+        if bus.valid(seq):
+            print("Frame %d: max %.4f, %d dropped" % (seq, peak, sub.dropped))
@@ -1,5 +1,6 @@
 import numpy as np
-from puff import Puff
+from puff import Puff, openingHazard
+import greens
 
 AMPLITUDE = 1
 HIDDEN_AMPLITUDE = .1
@@ -27,9 +28,10 @@ data = [[260.916,   63.486],
 
 data = np.array(data) // 4 - [20, 0]
 
-def uniform(points, size):
-    xs = np.random.uniform(0.15*size[0], size[0]*.85, points)
-    ys = np.random.uniform(0.15*size[1], size[1]*.85, points)
+def uniform(points, size, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    xs = rng.uniform(0.15*size[0], size[0]*.85, points)
+    ys = rng.uniform(0.15*size[1], size[1]*.85, points)
     return np.transpose([xs, ys]).astype(int)
 
 class Model():
@@ -45,6 +47,22 @@ class Model():
         self.sequestration = kargs.get('sequestration', 1.0)
         self.stop_early = kargs.get('stop_early', False)
         self.refresh = kargs.get('refresh', 50)
+        # evolve only the puff sites from cached responses when no movie is needed
+        self.greens = kargs.get('greens', False)
+        # keep every per-step sample in Puff.concentrations; with traces off,
+        # only the online accumulators in statistics see the samples
+        self.traces = kargs.get('traces', True)
+        self.statistics = kargs.get('statistics', [])
+        # run ends once no site is open, no closed site has an opening hazard
+        # of at least hazard_threshold, and the field changes by no more than
+        # tolerance in a step
+        self.tolerance = kargs.get('tolerance', 0)
+        self.hazard_threshold = kargs.get('hazard_threshold', 0)
+
+        # every random draw of the model descends from this seed, so equal
+        # seeds give identical runs. A seed of None draws fresh entropy,
+        # which is recorded in self.seed so the run can be repeated.
+        self.seedModel(kargs.get('seed', None))
 
         maxDt = self.dx**2*self.dy**2/( 2*self.d*(self.dx**2+self.dy**2) )
         if self.dt > maxDt:
@@ -61,21 +79,93 @@ class Model():
         else:
             self.puffs = puffs
             self.puffCount = len(puffs)
+            self.seedPuffs(puffs)
 
         hidden_puffs = kargs.get('hidden_puffs', 0)
         self.genPuffs(hidden_puffs, amplitude=HIDDEN_AMPLITUDE, reset=False)
+        self.resetCounters()
+
+    def resetCounters(self):
+        self.puffCount = len(self.puffs)
+        self.openCount = sum(p.open for p in self.puffs)
+        self.pendingCount = sum(p.pending() for p in self.puffs)
+        self.finishedCount = self.puffCount - self.openCount - self.pendingCount
+        self.maxHazard = np.inf
+        self.change = np.inf
+        self.time = 0
+        for acc in self.statistics:
+            acc.reset(self.puffCount)
 
     def finished(self):
-        return all([p.finished() for p in self.puffs])
+        return self.finishedCount == self.puffCount
+
+    def quiescent(self):
+        '''
+        True when no site is open and no closed site can still open, either
+        because every site has finished or because the largest opening
+        hazard any closed site could still reach is below hazard_threshold.
+        '''
+        if self.openCount > 0:
+            return False
+        return self.pendingCount == 0 or self.maxHazard < self.hazard_threshold
         
-    def genPuffs(self, n, amplitude=AMPLITUDE, reset=True):        
-        puffs = [Puff(a, b, amplitude) for a, b in uniform(n, [self.nx, self.ny])]
+    def __setstate__(self, state):
+        # models pickled before these settings existed load with the defaults
+        self.__dict__.update(state)
+        for k, v in {'greens': False, 'traces': True, 'tolerance': 0, 'hazard_threshold': 0}.items():
+            self.__dict__.setdefault(k, v)
+        self.__dict__.setdefault('statistics', [])
+        if 'seed' not in state:
+            self.seedModel(None)
+            self.seedPuffs()
+        self.resetCounters()
+
+    def seedModel(self, seed):
+        '''
+        Streams are keyed under the seed so they never overlap: (0,) for
+        construction draws, (1, k) for trial k and (2,) for an initial field
+        drawn outside any trial.
+        '''
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.sequence = np.random.SeedSequence(self.seed, spawn_key=(0,))
+        self.trial = -1
+        self.rng = np.random.default_rng(self.sequence)
+
+    def fieldRng(self):
+        ''' generator for an initial field that is not part of a trial '''
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(2,)))
+
+    def newTrial(self, trial=None, reset=True):
+        '''
+        Start an independent trial, by default the one after the last. The
+        model and every puff draw from child streams of the seed keyed by
+        the trial index, so trial k of a given seed is the same no matter
+        which process or worker runs it or which trials ran before. With
+        reset=False the puffs keep their state and only redraw close times.
+        '''
+        self.trial = self.trial + 1 if trial is None else trial
+        self.sequence = np.random.SeedSequence(self.seed, spawn_key=(1, self.trial))
+        self.rng = np.random.default_rng(self.sequence)
+        self.seedPuffs(reset=reset)
+
+    def seedPuffs(self, puffs=None, reset=False):
+        ''' give each puff its own child stream, clearing its state if reset '''
+        puffs = self.puffs if puffs is None else puffs
+        for p, child in zip(puffs, self.sequence.spawn(len(puffs))):
+            if reset:
+                p.reset(np.random.default_rng(child))
+            else:
+                p.seed(np.random.default_rng(child))
+
+    def genPuffs(self, n, amplitude=AMPLITUDE, reset=True):
+        puffs = [Puff(a, b, amplitude) for a, b in uniform(n, [self.nx, self.ny], self.rng)]
+        self.seedPuffs(puffs)
         if reset:
             self.puffs = puffs
         else:
             self.puffs.extend(puffs)
 
-        self.puffCount = len(self.puffs)
+        self.resetCounters()
 
     def export(self, fname):
         # x y amplitude openDuration 
@@ -85,15 +175,52 @@ class Model():
 
         np.savetxt(fname, d)
         
-    def handlePuffs(self, dt):
-        for p in self.puffs:
+    def handlePuffs(self, dt, values=None):
+        '''
+        Update every puff from the concentration at its site and return the
+        amount each one injected. Concentrations are read from and injections
+        added to the field self.u unless the site values are given.
+        '''
+        # one batched draw per step, one uniform per puff, consumed whether
+        # or not the puff needs it so the stream stays aligned across runs
+        draws = self.rng.random(len(self.puffs))
+        injected = np.zeros(len(self.puffs))
+        concentrations = np.zeros(len(self.puffs))
+        opened = np.zeros(len(self.puffs), dtype=bool)
+        # the hazard is only needed once nothing is open. With no sources and
+        # no growth the field maximum can only fall, so the hazard at that
+        # maximum bounds what any closed site can reach later. Greens mode
+        # has no field to bound the sites with, so it never stops on hazard.
+        checkHazard = self.openCount == 0 and self.hazard_threshold > 0 and self.sequestration <= 1 and values is None
+        for i, (p, draw) in enumerate(zip(self.puffs, draws)):
             #if p.finished():
             #    continue
-            valAtT = self.u[p.x, p.y]
-            v = p.update(dt, valAtT)
-            self.u[p.x, p.y] += v
+            valAtT = self.u[p.x, p.y] if values is None else values[i]
+            wasOpen = p.open
+            v = p.update(dt, valAtT, draw, self.traces)
+            if values is None:
+                self.u[p.x, p.y] += v
+            injected[i] = v
+            concentrations[i] = valAtT
+            if p.open and not wasOpen:
+                opened[i] = True
+                self.openCount += 1
+                self.pendingCount -= 1
+            elif wasOpen and not p.open:
+                self.openCount -= 1
+                self.finishedCount += 1
+        if checkHazard and self.pendingCount > 0:
+            self.maxHazard = openingHazard(dt, self.u.max(), Puff.OPEN_RATE)
+        else:
+            self.maxHazard = np.inf
+
+        self.time += dt
+        for acc in self.statistics:
+            acc.update(self.time, concentrations, opened)
+        return injected
 
-    def run(self, im):
+    def stencil(self):
+        ''' return the diffusion number and the number of time steps in a run '''
 
         #convert units to micron
         
@@ -102,30 +229,103 @@ class Model():
         dx = self.dx * 1e-6
         dy = self.dy * 1e-6
         t_max = self.t_max * 1e-3
-        x_max = self.x_max * 1e-6
-        y_max = self.y_max * 1e-6
 
         s = d*dt/(dy*dx)
-
-        x = np.arange(0,x_max+dx,dx)
-        y = np.arange(0,y_max+dy,dy) 
         t = np.arange(0,t_max+dt,dt)
-        r = len(t)
-        c = len(y)
-        d = len(x)
+        return s, len(t) - 1
+
+    def diffuse(self, field, s):
+        '''
+        Return the interior of field (or of a stack of fields along the
+        leading axes) after one time step, without modifying field.
+        '''
+        u = field[..., 1:-1, 1:-1] + s * (field[..., 2:, 1:-1] - 4*field[..., 1:-1, 1:-1] + field[..., :-2, 1:-1] + field[..., 1:-1, 2:] + field[..., 1:-1, :-2])
+        u *= self.sequestration
+        u[..., :, 0] = u[..., :, 1]
+        u[..., :, -1] = u[..., :, -2]
+        u[..., 0, :] = u[..., 1, :]
+        u[..., -1, :] = u[..., -2, :]
+        return u
+
+    def run(self, im, movie=True):
+        '''
+        Simulate from the initial field im, yielding the field after every
+        step. In greens mode with movie=False and sequestration below 1 the
+        full grid is not stepped and the concentrations at the puff sites
+        are yielded instead.
+        '''
+        if self.greens and not movie and self.sequestration < 1:
+            yield from self.runGreens(im)
+            return
+
+        s, steps = self.stencil()
         self.u = im.copy()
-        for n in range(0,r-1): # time
-            u = self.u[1:-1, 1:-1] + s * (self.u[2:, 1:-1] - 4*self.u[1:-1, 1:-1] + self.u[:-2, 1:-1] + self.u[1:-1, 2:] + self.u[1:-1, :-2])
-            u *= self.sequestration
-            u[:, 0] = u[:, 1]
-            u[:, -1] = u[:, -2]
-            u[0, :] = u[1, :]
-            u[-1, :] = u[-2, :]
-            
-            self.u[1:-1, 1:-1] = u.copy()
+        self.resetCounters()
+        for n in range(steps): # time
+            u = self.diffuse(self.u, s)
+
+            # only measure convergence when it can end the run
+            if not self.stop_early and self.quiescent():
+                self.change = np.abs(u - self.u[1:-1, 1:-1]).max()
+            else:
+                self.change = np.inf
+
+            self.u[1:-1, 1:-1] = u
             self.handlePuffs(self.dt)
             yield self.u
-            if self.stop_early and self.finished():
+            if self.quiescent() and (self.stop_early or self.change <= self.tolerance):
+                break
+
+    def runGreens(self, im):
+        '''
+        Evolve only the puff site concentrations. The PDE is linear and each
+        puff injects at a constant rate while open, so the value at a site is
+        the free evolution of im plus a sum of precomputed site-to-site
+        responses over the injection intervals (see greens.Kernels).
+        '''
+        s, steps = self.stencil()
+        xs = np.array([p.x for p in self.puffs], dtype=int)
+        ys = np.array([p.y for p in self.puffs], dtype=int)
+        kernels = greens.kernels(self, xs, ys)
+
+        # the initial field is stepped on its own only until it stops
+        # changing, after which its site values are held fixed. A uniform
+        # interior stays uniform and only decays by the sequestration.
+        free = im.copy()
+        freeValues = free[xs, ys]
+        uniform = np.ptp(free[1:-1, 1:-1]) == 0
+        freeActive = not uniform
+
+        starts = np.full(len(self.puffs), -1)
+        ends = np.full(len(self.puffs), -1)
+        rates = np.zeros(len(self.puffs))
+        values = np.zeros(len(self.puffs))
+
+        self.resetCounters()
+        for n in range(1, steps+1): # time
+            last = values
+            if freeActive:
+                u = self.diffuse(free, s)
+                freeActive = np.abs(u - free[1:-1, 1:-1]).max() >= kernels.tol
+                free[1:-1, 1:-1] = u
+                freeValues = free[xs, ys]
+            elif uniform:
+                freeValues = freeValues * self.sequestration
+            values = freeValues + kernels.response(n, starts, ends, rates)
+
+            if not self.stop_early and self.quiescent():
+                self.change = np.abs(values - last).max(initial=0)
+            else:
+                self.change = np.inf
+
+            injected = self.handlePuffs(self.dt, values)
+            opened = (injected != 0) & (starts < 0)
+            starts[opened] = n
+            rates[opened] = injected[opened]
+            closed = (injected == 0) & (starts >= 0) & (ends < 0)
+            ends[closed] = n - 1
+            yield values
+            if self.quiescent() and (self.stop_early or self.change <= self.tolerance):
                 break
             
 d = 20 # um**2/s
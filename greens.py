@@ -0,0 +1,70 @@
+import numpy as np
+from collections import OrderedDict
+
+TOLERANCE = 1e-12
+# each entry holds a steps x sites x sites array, so keep only a few layouts
+CACHE_SIZE = 2
+
+_cache = OrderedDict()
+
+class Kernels():
+    '''
+    Site-to-site impulse responses of a Model geometry. cumulative[k, i, j]
+    is the concentration at site j summed over the k steps following a unit
+    injection at site i, so a constant injection over an interval costs two
+    lookups. Responses are computed for all sites at once by stepping a stack
+    of impulse fields, and stop once no site gains more than tol in a step.
+    That only happens with sequestration below 1; without it the responses
+    level off at a uniform value and never truncate, so Model.run steps the
+    full grid instead.
+    '''
+
+    def __init__(self, model, xs, ys, tol=TOLERANCE):
+        self.tol = tol
+        s, steps = model.stencil()
+        n = len(xs)
+        field = np.zeros([n, model.nx+2, model.ny+2])
+        field[np.arange(n), xs, ys] = 1
+
+        # untouched pages of the zeroed array are never committed, so only
+        # the steps computed before truncation take memory
+        cumulative = np.zeros([steps+1, n, n])
+        last = steps
+        for k in range(1, steps+1):
+            field[:, 1:-1, 1:-1] = model.diffuse(field, s)
+            increment = field[:, xs, ys]
+            cumulative[k] = cumulative[k-1] + increment
+            if np.abs(increment).max() < tol:
+                last = k
+                break
+        self.cumulative = cumulative[:last+1].copy() if last < steps else cumulative
+
+    def response(self, n, starts, ends, rates):
+        '''
+        Concentration at every site at step n due to the puffs that started
+        injecting rates at step starts and stopped after step ends (-1 while
+        still open, or for puffs that never opened).
+        '''
+        out = np.zeros(self.cumulative.shape[1])
+        last = len(self.cumulative) - 1
+        started = np.flatnonzero(starts >= 0)
+        if len(started) == 0:
+            return out
+        lags = np.minimum(n - starts[started], last)
+        out += rates[started] @ self.cumulative[lags, started]
+        ended = started[ends[started] >= 0]
+        lags = np.minimum(n - ends[ended] - 1, last)
+        out -= rates[ended] @ self.cumulative[lags, ended]
+        return out
+
+def kernels(model, xs, ys, tol=TOLERANCE):
+    ''' return the Kernels for the model geometry and these sites, cached for the last few layouts '''
+    s, steps = model.stencil()
+    key = (model.nx, model.ny, s, model.sequestration, steps, tuple(xs), tuple(ys), tol)
+    if key in _cache:
+        _cache.move_to_end(key)
+    else:
+        while len(_cache) >= CACHE_SIZE:
+            _cache.popitem(last=False)
+        _cache[key] = Kernels(model, xs, ys, tol)
+    return _cache[key]
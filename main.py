@@ -6,6 +6,7 @@ import pyqtgraph as pg
 from pyqtgraph.console import ConsoleWidget
 from gen import models, uniform, save_model, Model, save_models, HIDDEN_AMPLITUDE, AMPLITUDE
 from puff import Puff
+from framebus import FrameBus, Subscriber
 
 
 class PuffTable(pg.TableWidget):
@@ -215,7 +216,8 @@ class MainWindow(QtWidgets.QMainWindow):
         d = self.dSpin.value()
         refresh = self.refreshSpin.value()
         stop_early = self.stopEarlyCheck.isChecked()
-        return Model(d=d, dt=dt, dx=dx, dy=dy, t_max=t_max, x_max=x_max, y_max=y_max, puffs=puffs, sequestration=sequestration, refresh=refresh, stop_early=stop_early) 
+        seed = self.seedSpin.value()
+        return Model(d=d, dt=dt, dx=dx, dy=dy, t_max=t_max, x_max=x_max, y_max=y_max, puffs=puffs, sequestration=sequestration, refresh=refresh, stop_early=stop_early, seed=seed)
 
     def mouseMoved(self, point):
         mouse = self.imageview.getImageItem().mapFromScene(point)
@@ -339,11 +341,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.refreshSpin.setValue(100)
         self.stopEarlyCheck = QtWidgets.QCheckBox()
         self.stopEarlyCheck.setChecked(True)
+        self.seedSpin = QtWidgets.QSpinBox()
+        self.seedSpin.setRange(0, 2**31 - 1)
+        self.seedSpin.setValue(0)
 
         layout.addRow("Diffusion Coefficient (micron**2 / s)", self.dSpin)
         layout.addRow("Sequestration Coefficient", self.sequesterSpin)
         layout.addRow("Interval Refresh Rate", self.refreshSpin)
         layout.addRow("Quit when all puffs close", self.stopEarlyCheck)
+        layout.addRow("Random Seed", self.seedSpin)
         widg.setLayout(layout)
         return widg
 
@@ -356,7 +362,7 @@ class MainWindow(QtWidgets.QMainWindow):
             if self.onesRadio.isChecked():
                 z += 1
             elif self.randomRadio.isChecked():
-                z += 0.05*np.random.random((m.nx,m.ny))
+                z += 0.05*m.fieldRng().random((m.nx,m.ny))
 
         self.puffs = []
         points = []
@@ -389,29 +395,42 @@ class MainWindow(QtWidgets.QMainWindow):
         
         self.model = self.getModel()
         m = self.model
+        # same seed, same run; puffs opened by clicking stay open
+        m.newTrial(0, reset=False)
         refreshRate = self.refreshSpin.value()
         frames = (m.nt) // refreshRate + 1
         movie = np.zeros([frames, m.nx+2, m.ny+2])
 
         movie[0] = self.imageview.getImageItem().image
+        # the view previews the newest published frame while the run goes on,
+        # skipping any it is too slow to draw
+        bus = FrameBus(movie[0].shape, slots=4)
+        preview = Subscriber(bus)
         i = 1
         p = 0
         self.startButton.setText("Stop")
         self.running = True
-        for im in m.run(movie[0]):
-            if not self.running:
-                break
-            if i % refreshRate == 0:
-                movie[i // refreshRate] = im
-            
-            if (100 * i) // m.nt > p:
-                p = (100 * i) // m.nt
-                self.progressBar.setValue(p)
-            QtWidgets.qApp.processEvents()
-            i += 1
-
-        self.progressBar.setValue(100)
-        self.showImage(movie)
+        try:
+            for im in m.run(movie[0]):
+                if not self.running:
+                    break
+                if i % refreshRate == 0:
+                    movie[i // refreshRate] = im
+                    bus.publish(im)
+                
+                if (100 * i) // m.nt > p:
+                    p = (100 * i) // m.nt
+                    self.progressBar.setValue(p)
+                    frame = preview.latest()
+                    if frame is not None:
+                        self.imageview.setImage(frame[1], autoLevels=False, autoRange=False, autoHistogramRange=False)
+                QtWidgets.qApp.processEvents()
+                i += 1
+        finally:
+            # the preview shows a view into the bus, replace it before closing
+            self.progressBar.setValue(100)
+            self.showImage(movie)
+            bus.close()
 
         self.running = False
         self.startButton.setText("Start")
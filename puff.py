@@ -1,31 +1,53 @@
 import numpy as np
-import random
 
 OPEN_DURATION = 100
 
+def openingHazard(dt, concentration, rate):
+	''' probability that a closed site opens during a step of length dt '''
+	return np.exp(1 + 20 * concentration) * rate * 1e-5 * dt
+
 class Puff:
 	OPEN_RATE = 5
-	def __init__(self, x, y, amplitude=1):
+	def __init__(self, x, y, amplitude=1, rng=None):
 		self.x = int(x)
 		self.y = int(y)
 		self.amplitude = amplitude
+		self.pToggle = Puff.OPEN_RATE
+		self.reset(rng)
+
+	def reset(self, rng=None):
+		''' clear the puff state and redraw its close time from its own stream '''
 		self.open = False
 		self.openDuration = 0.
 		self.timeToOpen = 0.
 		self.concentrations = []
-		self.pToggle = Puff.OPEN_RATE
-		duration = min(1, amplitude) * OPEN_DURATION
-		self.closeTime = min(300, random.expovariate(1/duration))
+		self.seed(rng)
+
+	def seed(self, rng=None):
+		''' draw from rng from now on and redraw the close time, keeping the state '''
+		self.rng = rng if rng is not None else np.random.default_rng()
+		duration = min(1, self.amplitude) * OPEN_DURATION
+		self.closeTime = min(300, self.rng.exponential(duration))
 
 	def finished(self):
 		return self.open == False and self.openDuration > 0
 
-	def tryToggleOpen(self, dt, concentration):
-		if np.random.random() < (np.exp(1 + 20 * concentration) * self.pToggle * 1e-5 * dt):
+	def pending(self):
+		return self.open == False and self.openDuration == 0
+
+	def hazard(self, dt, concentration):
+		''' probability of opening during a step of length dt '''
+		return openingHazard(dt, concentration, self.pToggle)
+
+	def tryToggleOpen(self, dt, concentration, draw=None):
+		if draw is None:
+			draw = self.rng.random()
+		if draw < self.hazard(dt, concentration):
 			self.open = not self.open
 
-	def update(self, dt, concentration):
-		self.concentrations.append(concentration)
+	def update(self, dt, concentration, draw=None, record=True):
+		if record:
+			self.concentrations.append(concentration)
 		val = 0
 		if self.open:
 			self.openDuration += dt
@@ -35,7 +57,7 @@ class Puff:
 				print("Puff closes at %d" % (self.timeToOpen + self.openDuration))
 			#self.tryToggleOpen(dt, concentration)
 		elif self.openDuration == 0:
-			self.tryToggleOpen(dt, concentration)
+			self.tryToggleOpen(dt, concentration, draw)
 			if not self.open:
 				self.timeToOpen += dt
 			else:
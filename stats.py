@@ -0,0 +1,82 @@
+import numpy as np
+
+class Accumulator():
+    '''
+    Online statistic over the per-puff concentrations of a run. The model
+    calls reset with the number of puffs when a run starts, then update
+    every step with the time (ms), the concentration at each site and a
+    mask of the puffs that opened during that step.
+    '''
+
+    def reset(self, n):
+        pass
+
+    def update(self, t, values, opened):
+        pass
+
+class Welford(Accumulator):
+    ''' running mean and variance of each puff's concentration '''
+
+    def reset(self, n):
+        self.count = 0
+        self.mean = np.zeros(n)
+        self.m2 = np.zeros(n)
+
+    def update(self, t, values, opened):
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return np.zeros_like(self.m2)
+        return self.m2 / (self.count - 1)
+
+class MinMax(Accumulator):
+    ''' lowest and highest (peak) concentration at each puff '''
+
+    def reset(self, n):
+        self.min = np.full(n, np.inf)
+        self.max = np.full(n, -np.inf)
+
+    def update(self, t, values, opened):
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+
+class Histogram(Accumulator):
+    '''
+    Histogram over fixed bins of the concentrations seen at every step, or
+    only those at the moment each puff opens when opening is True. Values
+    outside the bins are counted in the first or last bin.
+    '''
+
+    def __init__(self, bins=50, range=(0, 2), opening=False):
+        self.edges = np.linspace(range[0], range[1], bins + 1)
+        self.opening = opening
+        self.counts = np.zeros(bins, dtype=int)
+
+    def reset(self, n):
+        self.counts[:] = 0
+
+    def update(self, t, values, opened):
+        if self.opening:
+            values = values[opened]
+            if len(values) == 0:
+                return
+        i = np.searchsorted(self.edges, values, side='right') - 1
+        np.add.at(self.counts, np.clip(i, 0, len(self.counts) - 1), 1)
+
+class FirstCrossing(Accumulator):
+    ''' time (ms) at which each puff's concentration first reaches threshold, nan if never '''
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+
+    def reset(self, n):
+        self.times = np.full(n, np.nan)
+
+    def update(self, t, values, opened):
+        crossed = np.isnan(self.times) & (values >= self.threshold)
+        self.times[crossed] = t